@@ -1,9 +1,16 @@
 import streamlit as st
 import pandas as pd
 import io
-import difflib
-import plotly.express as px
-import plotly.graph_objects as go
+import re
+import numpy as np
+import xlsxwriter
+from rapidfuzz import fuzz, process
+
+try:
+    from python_calamine import CalamineError
+except ImportError:
+    # Without calamine, read_excel_file goes straight to the ImportError fallback
+    CalamineError = ImportError
 
 # --- Configuration ---
 st.set_page_config(
@@ -15,28 +22,47 @@ st.set_page_config(
 # Increase pandas styler limit for large dataframes
 pd.set_option("styler.render.max_elements", 1000000)
 
+# Above this many rows the comparison table skips the pandas Styler (per-cell CSS),
+# so the Diferencia $ column is shown without the red/green highlight
+STYLED_MAX_ROWS = 5000
+
 # --- Utilities ---
 
-def clean_price(val):
+# Accepted source column names (lowercase, in order of preference) for each standard key
+COLUMN_CANDIDATES = {
+    'Clave': ('clave', 'codigo', 'sku'),
+    'Descripcion': ('descripción', 'descripcion', 'nombre'),
+    'Precio': ('precio', 'costo'),
+}
+
+# Anything that is not a digit, dot or minus sign (currency symbols, commas, spaces...)
+_PRICE_RE = re.compile(r'[^0-9.\-]')
+
+def clean_price_series(series):
     """
-    Cleans a price value to ensure it's a float.
-    Handles strings with currency symbols, commas, etc.
+    Cleans a price column to ensure it's float.
+    Handles strings with currency symbols, commas, etc.; blanks and text that is
+    not a number become 0.0.
+    Numeric columns are only rounded; text columns are cleaned with a single regex pass.
     """
-    if pd.isna(val) or val == "":
-        return 0.0
-    if isinstance(val, (int, float)):
-        return float(val)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64').fillna(0.0).round(2)
     
-    # Convert to string and clean
-    s = str(val)
-    # Remove non-numeric characters except dot and minus
-    # This is a simple regex replacement
-    import re
-    cleaned = re.sub(r'[^0-9.-]', '', s)
+    cleaned = series.astype('string[pyarrow]').str.replace(_PRICE_RE.pattern, '', regex=True)
+    return pd.to_numeric(cleaned, errors='coerce').astype('float64').fillna(0.0).round(2)
+
+def read_excel_file(file):
+    """
+    Reads an Excel file using the fast calamine engine, falling back to the
+    default pandas engine if calamine is unavailable or cannot parse the file.
+    Every column is read as Arrow-backed text: this preserves leading zeros in IDs
+    and also handles columns that mix text and numeric cells.
+    """
     try:
-        return float(cleaned)
-    except ValueError:
-        return 0.0
+        return pd.read_excel(file, engine="calamine", dtype='string[pyarrow]')
+    except (ImportError, ValueError, CalamineError):
+        file.seek(0)
+        return pd.read_excel(file, dtype='string[pyarrow]')
 
 def normalize_columns(df):
     """
@@ -45,28 +71,16 @@ def normalize_columns(df):
     """
     df.columns = df.columns.astype(str).str.strip()
     
-    col_map = {}
+    # Case-insensitive lookup of the sheet's columns, built once
+    cols_lower = {}
+    for c in df.columns:
+        cols_lower.setdefault(c.lower(), c)
     
-    # Find Clave
-    clave_cols = ['Clave', 'clave', 'CLAVE', 'Codigo', 'codigo', 'SKU', 'sku']
-    for c in clave_cols:
-        if c in df.columns:
-            col_map[c] = 'Clave'
-            break
-            
-    # Find Descripcion
-    desc_cols = ['Descripción', 'Descripcion', 'descripcion', 'Nombre', 'nombre']
-    for c in desc_cols:
-        if c in df.columns:
-            col_map[c] = 'Descripcion'
-            break
-            
-    # Find Precio
-    price_cols = ['Precio', 'precio', 'PRECIO', 'Costo', 'costo']
-    for c in price_cols:
-        if c in df.columns:
-            col_map[c] = 'Precio'
-            break
+    col_map = {}
+    for target, candidates in COLUMN_CANDIDATES.items():
+        source = next((cols_lower[k] for k in candidates if k in cols_lower), None)
+        if source is not None:
+            col_map[source] = target
             
     if 'Clave' not in col_map.values():
         return df, False
@@ -80,9 +94,12 @@ def normalize_columns(df):
         df['Precio'] = 0.0
         
     # Clean data types
-    df['Clave'] = df['Clave'].astype(str).str.strip()
-    df['Descripcion'] = df['Descripcion'].astype(str).fillna("")
-    df['Precio'] = df['Precio'].apply(clean_price).round(2)
+    # Keys are trimmed and upper-cased so 'abc123' and 'ABC123 ' match across files
+    df['Clave'] = df['Clave'].astype('string[pyarrow]').str.strip().str.upper()
+    # Rows without a key (blank lines, trailing totals...) can't be compared
+    df = df[df['Clave'].fillna("") != ""].copy()
+    df['Descripcion'] = df['Descripcion'].astype('string[pyarrow]').fillna("")
+    df['Precio'] = clean_price_series(df['Precio'])
     
     # Special handling for "Campo Extra": treat as numeric
     if 'Campo Extra' in df.columns:
@@ -90,11 +107,79 @@ def normalize_columns(df):
     
     return df, True
 
-def calculate_text_similarity(s1, s2):
-    """Calculates similarity ratio between two strings."""
-    if not s1 or not s2:
-        return 0.0
-    return difflib.SequenceMatcher(None, str(s1).lower(), str(s2).lower()).ratio() * 100
+def text_similarity_series(desc_a, desc_b):
+    """
+    Calculates the similarity ratio for two aligned description columns.
+    Returns a float array with one score per row (0 when either side is empty).
+    """
+    # Lowercase with the Arrow string kernel, then hand Python strings to rapidfuzz
+    a = desc_a.astype('string[pyarrow]').fillna("").str.lower().to_numpy(dtype=object)
+    b = desc_b.astype('string[pyarrow]').fillna("").str.lower().to_numpy(dtype=object)
+    
+    # Most matched products keep the same description: score those as 100 without
+    # calling the similarity kernel, and only compare the rows that differ
+    sim = np.full(len(a), 100.0)
+    diff_rows = np.nonzero(a != b)[0]
+    if len(diff_rows):
+        # Pairwise scores computed in parallel on all cores (the GIL is released)
+        sim[diff_rows] = process.cpdist(a[diff_rows], b[diff_rows], scorer=fuzz.ratio, dtype=np.float64, workers=-1)
+    
+    sim[(a == "") | (b == "")] = 0.0
+    return sim
+
+def split_by_clave(df_a, df_b):
+    """
+    Splits two inventories by Clave using set operations on their key indexes,
+    which avoids an outer merge and its indicator column.
+    Returns the side-by-side frame of keys present in both files (columns present
+    in both get the '_A' / '_B' suffixes) and the rows only found in A and only in B.
+    Clave must be unique in both frames.
+    """
+    a_idx = df_a.set_index('Clave')
+    b_idx = df_b.set_index('Clave')
+    
+    common_keys = a_idx.index.intersection(b_idx.index, sort=False)
+    only_a_keys = a_idx.index.difference(b_idx.index, sort=False)
+    only_b_keys = b_idx.index.difference(a_idx.index, sort=False)
+    
+    # .loc already returns new frames: label columns and restore Clave in place
+    # instead of going through rename/reset_index, which would copy them again
+    shared = a_idx.columns.intersection(b_idx.columns)
+    common = pd.concat([a_idx.loc[common_keys], b_idx.loc[common_keys]], axis=1)
+    common.columns = (
+        [f'{c}_A' if c in shared else c for c in a_idx.columns] +
+        [f'{c}_B' if c in shared else c for c in b_idx.columns]
+    )
+    common.index.name = 'Clave'
+    common.reset_index(inplace=True)
+    
+    only_a = a_idx.loc[only_a_keys].reset_index()
+    only_b = b_idx.loc[only_b_keys].reset_index()
+    
+    return common, only_a, only_b
+
+def write_sheet(workbook, sheet_name, df, header_format=None, column_formats=None):
+    """
+    Writes a DataFrame to a new worksheet row by row.
+    Rows are written in order so the workbook can run in constant_memory mode,
+    which flushes each row to disk instead of keeping every cell in memory.
+    column_formats maps column names to cell formats; they are applied before
+    any row is written, since flushed rows can no longer be styled.
+    """
+    worksheet = workbook.add_worksheet(sheet_name)
+    for col_name, col_format in (column_formats or {}).items():
+        col_idx = df.columns.get_loc(col_name)
+        worksheet.set_column(col_idx, col_idx, None, col_format)
+    
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], header_format)
+    
+    # Convert each column to a list of Python values once (NaN becomes a blank cell),
+    # then stream the rows out of the column lists
+    columns = [df[c].astype(object).where(df[c].notna(), None).tolist() for c in df.columns]
+    for row_idx, row in enumerate(zip(*columns), start=1):
+        worksheet.write_row(row_idx, 0, row)
+    
+    return worksheet
 
 @st.cache_data
 def convert_df_to_excel(results):
@@ -102,43 +187,121 @@ def convert_df_to_excel(results):
     Converts the results dictionary into a downloadable Excel file.
     """
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+    # nan_inf_to_errors: write inf values (e.g. a huge Campo Extra) as Excel errors instead of raising
+    options = {'constant_memory': True, 'strings_to_urls': False, 'nan_inf_to_errors': True}
+    with xlsxwriter.Workbook(output, options) as workbook:
+        header_format = workbook.add_format({'bold': True})
+        
         # Summary Sheet
         summary_data = {
             'Métrica': ['Total Archivo A', 'Total Archivo B', 'Coincidencias', 'Solo en A', 'Solo en B'],
             'Valor': [results['total_a'], results['total_b'], results['common_count'], results['only_a_count'], results['only_b_count']]
         }
-        pd.DataFrame(summary_data).to_excel(writer, sheet_name='Resumen', index=False)
+        write_sheet(workbook, 'Resumen', pd.DataFrame(summary_data), header_format)
         
         # Common Sheet
         if not results['common_df'].empty:
-            common_sheet_name = 'Coincidencias'
-            results['common_df'].to_excel(writer, sheet_name=common_sheet_name, index=False)
-            
-            # Apply Number Format to 'Campo Extra' if it exists
-            workbook = writer.book
-            worksheet = writer.sheets[common_sheet_name]
-            
+            # Apply Number Format to 'Campo Extra' if it exists: 6 digits with leading zeros
+            column_formats = {}
             if 'Campo Extra' in results['common_df'].columns:
-                # Find the column index (0-based)
-                col_idx = results['common_df'].columns.get_loc('Campo Extra')
-                
-                # Define format: 6 digits with leading zeros
-                id_format = workbook.add_format({'num_format': '000000'})
-                
-                # Apply to the column (width=None to keep default/autosize logic if any, or set a fixed width)
-                worksheet.set_column(col_idx, col_idx, None, id_format)
+                column_formats['Campo Extra'] = workbook.add_format({'num_format': '000000'})
+            
+            write_sheet(workbook, 'Coincidencias', results['common_df'], header_format, column_formats)
             
         # Only A Sheet
         if not results['only_a_df'].empty:
-            results['only_a_df'].to_excel(writer, sheet_name='Solo en A', index=False)
+            write_sheet(workbook, 'Solo en A', results['only_a_df'], header_format)
             
         # Only B Sheet
         if not results['only_b_df'].empty:
-            results['only_b_df'].to_excel(writer, sheet_name='Solo en B', index=False)
+            write_sheet(workbook, 'Solo en B', results['only_b_df'], header_format)
             
     return output.getvalue()
 
+@st.cache_data(show_spinner=False)
+def run_analysis(bytes_a, bytes_b):
+    """
+    Runs the full comparison between two Excel files given as raw bytes.
+    Cached on the file contents so widget-triggered reruns don't recompute it.
+    Returns the results dictionary and an error message (None on success).
+    """
+    # Load Data
+    df_a_raw = read_excel_file(io.BytesIO(bytes_a))
+    df_b_raw = read_excel_file(io.BytesIO(bytes_b))
+    
+    df_a, valid_a = normalize_columns(df_a_raw)
+    df_b, valid_b = normalize_columns(df_b_raw)
+    
+    if not valid_a:
+        return None, "Error en Archivo A: No se encontró una columna de 'Clave' o 'Código'."
+    if not valid_b:
+        return None, "Error en Archivo B: No se encontró una columna de 'Clave' o 'Código'."
+    
+    # Drop columns with no data in either file (e.g. blank 'Unnamed: N' columns from the sheet)
+    # so they are not carried through the comparison and into the report.
+    # A column with data on one side is kept on both so it still gets its '_A' / '_B' suffix.
+    empty_a = set(df_a.columns[df_a.isna().all()])
+    empty_b = set(df_b.columns[df_b.isna().all()])
+    df_a = df_a.drop(columns=[c for c in df_a.columns if c in empty_a and (c in empty_b or c not in df_b.columns)])
+    df_b = df_b.drop(columns=[c for c in df_b.columns if c in empty_b and (c in empty_a or c not in df_a.columns)])
+    
+    # Totals count every row with a Clave, before duplicated keys are dropped;
+    # rows without a key were already removed by normalize_columns and are reported apart
+    total_a = len(df_a)
+    total_b = len(df_b)
+    
+    # Inventory rows are keyed by Clave: keep the last occurrence of duplicated keys
+    # (the number of dropped rows is reported to the user)
+    df_a = df_a.drop_duplicates(subset='Clave', keep='last')
+    df_b = df_b.drop_duplicates(subset='Clave', keep='last')
+    
+    # Analysis
+    # Split keys into common / only in A / only in B (no outer merge needed)
+    common, only_a, only_b = split_by_clave(df_a, df_b)
+    
+    # Common
+    common['Diferencia $'] = (common['Precio_B'] - common['Precio_A']).round(2)
+    price_a = common['Precio_A'].to_numpy(dtype='float64')
+    diff = common['Diferencia $'].to_numpy(dtype='float64')
+    common['Diferencia %'] = np.divide(diff, price_a, out=np.zeros_like(diff), where=price_a != 0) * 100
+    
+    # Text Similarity (expensive operation, apply only to common)
+    common['Similitud Texto'] = text_similarity_series(common['Descripcion_A'], common['Descripcion_B'])
+    
+    # Define base columns for Common report
+    base_cols = ['Clave', 'Descripcion_A', 'Descripcion_B', 'Precio_A', 'Precio_B', 'Diferencia $', 'Diferencia %', 'Similitud Texto']
+    
+    # Identify extra columns in common that are not in base_cols
+    # This ensures columns like 'Color', 'Marca', etc. are included
+    extra_cols = [c for c in common.columns if c not in base_cols]
+    
+    # Special ordering: if 'Campo Extra' exists, put it first
+    if 'Campo Extra' in extra_cols:
+        extra_cols.remove('Campo Extra')
+        # Insert at the very beginning of the final list (even before Clave?) 
+        # User requested: "at the very start of the output excel dataset"
+        final_common_cols = ['Campo Extra'] + base_cols + extra_cols
+    else:
+        final_common_cols = base_cols + extra_cols
+
+    # Results Object
+    results = {
+        'total_a': total_a,
+        'total_b': total_b,
+        'blank_keys_a': len(df_a_raw) - total_a,
+        'blank_keys_b': len(df_b_raw) - total_b,
+        'duplicates_a': total_a - len(df_a),
+        'duplicates_b': total_b - len(df_b),
+        'common_count': len(common),
+        'only_a_count': len(only_a),
+        'only_b_count': len(only_b),
+        'common_df': common[final_common_cols],
+        'only_a_df': only_a,
+        'only_b_df': only_b
+    }
+    
+    return results, None
+
 # --- Main App ---
 
 def main():
@@ -157,70 +320,26 @@ def main():
         file_b = st.file_uploader("📂 Archivo B (Nuevo/Comparar)", type=['xlsx', 'xls'])
         
     if file_a and file_b:
+        # Plotly is only needed once both files are uploaded; importing it here keeps the first render fast
+        import plotly.express as px
+        import plotly.graph_objects as go
+        
         st.divider()
         with st.spinner("Procesando archivos..."):
             try:
-                # Load Data
-                # Load Data with dtype=str to preserve leading zeros in IDs
-                df_a_raw = pd.read_excel(file_a, dtype=str)
-                df_b_raw = pd.read_excel(file_b, dtype=str)
-                
-                df_a, valid_a = normalize_columns(df_a_raw)
-                df_b, valid_b = normalize_columns(df_b_raw)
-                
-                if not valid_a:
-                    st.error(f"Error en Archivo A: No se encontró una columna de 'Clave' o 'Código'.")
-                    return
-                if not valid_b:
-                    st.error(f"Error en Archivo B: No se encontró una columna de 'Clave' o 'Código'.")
+                results, error = run_analysis(file_a.getvalue(), file_b.getvalue())
+                if error:
+                    st.error(error)
                     return
                 
-                # Analysis
-                # 1. Merge for Common
-                # We use outer join to get everything, then split
-                merged = pd.merge(df_a, df_b, on='Clave', how='outer', suffixes=('_A', '_B'), indicator=True)
-                
-                # Common
-                common = merged[merged['_merge'] == 'both'].copy()
-                common['Diferencia $'] = (common['Precio_B'] - common['Precio_A']).round(2)
-                common['Diferencia %'] = common.apply(lambda x: (x['Diferencia $'] / x['Precio_A'] * 100) if x['Precio_A'] != 0 else 0, axis=1)
-                
-                # Text Similarity (expensive operation, apply only to common)
-                common['Similitud Texto'] = common.apply(lambda x: calculate_text_similarity(x['Descripcion_A'], x['Descripcion_B']), axis=1)
-                
-                # Only A (Use direct filtering to preserve all original columns from A)
-                only_a = df_a[~df_a['Clave'].isin(df_b['Clave'])].copy()
-                
-                # Only B (Use direct filtering to preserve all original columns from B)
-                only_b = df_b[~df_b['Clave'].isin(df_a['Clave'])].copy()
-                
-                # Define base columns for Common report
-                base_cols = ['Clave', 'Descripcion_A', 'Descripcion_B', 'Precio_A', 'Precio_B', 'Diferencia $', 'Diferencia %', 'Similitud Texto']
-                
-                # Identify extra columns in merged that are not in base_cols and not the merge indicator
-                # This ensures columns like 'Color', 'Marca', etc. are included
-                extra_cols = [c for c in common.columns if c not in base_cols and c != '_merge']
-                
-                # Special ordering: if 'Campo Extra' exists, put it first
-                if 'Campo Extra' in extra_cols:
-                    extra_cols.remove('Campo Extra')
-                    # Insert at the very beginning of the final list (even before Clave?) 
-                    # User requested: "at the very start of the output excel dataset"
-                    final_common_cols = ['Campo Extra'] + base_cols + extra_cols
-                else:
-                    final_common_cols = base_cols + extra_cols
-
-                # Results Object
-                results = {
-                    'total_a': len(df_a),
-                    'total_b': len(df_b),
-                    'common_count': len(common),
-                    'only_a_count': len(only_a),
-                    'only_b_count': len(only_b),
-                    'common_df': common[final_common_cols],
-                    'only_a_df': only_a,
-                    'only_b_df': only_b
-                }
+                if results['blank_keys_a']:
+                    st.warning(f"Archivo A: se ignoraron {results['blank_keys_a']} filas sin Clave.")
+                if results['blank_keys_b']:
+                    st.warning(f"Archivo B: se ignoraron {results['blank_keys_b']} filas sin Clave.")
+                if results['duplicates_a']:
+                    st.warning(f"Archivo A: se ignoraron {results['duplicates_a']} filas con Clave duplicada (se conservó la última).")
+                if results['duplicates_b']:
+                    st.warning(f"Archivo B: se ignoraron {results['duplicates_b']} filas con Clave duplicada (se conservó la última).")
                 
                 # --- Dashboard ---
                 
@@ -253,37 +372,43 @@ def main():
                     fig_bar.update_layout(title_text='Comparativa de Volumen', barmode='group')
                     st.plotly_chart(fig_bar, use_container_width=True)
                 
+                # Number formatting is done client-side by the grid (no per-cell Python work).
+                # When a Styler is passed, column_config formats still take precedence over its display values.
+                money_format = st.column_config.NumberColumn(format="dollar")
+                
                 # Tabs for Data
                 tab1, tab2, tab3 = st.tabs(["📊 Coincidencias", "⚠️ Solo en A", "🆕 Solo en B"])
                 
                 with tab1:
                     st.subheader("Productos en ambos archivos")
                     
-                    # Styling for the dataframe
-                    def highlight_diff(val):
-                        if isinstance(val, (int, float)) and val != 0:
-                            color = 'red' if val > 0 else 'green'
-                            return f'color: {color}; font-weight: bold'
-                        return ''
-
-                    st.dataframe(
-                        results['common_df'].style.format({
-                            'Precio_A': '${:,.2f}',
-                            'Precio_B': '${:,.2f}',
-                            'Diferencia $': '${:,.2f}',
-                            'Diferencia %': '{:.2f}%',
-                            'Similitud Texto': '{:.1f}%'
-                        }).map(highlight_diff, subset=['Diferencia $']),
-                        use_container_width=True
-                    )
+                    common_config = {
+                        'Precio_A': money_format,
+                        'Precio_B': money_format,
+                        'Diferencia $': money_format,
+                        'Diferencia %': st.column_config.NumberColumn(format="%.2f%%"),
+                        'Similitud Texto': st.column_config.NumberColumn(format="%.1f%%")
+                    }
+                    
+                    common_df = results['common_df']
+                    if len(common_df) <= STYLED_MAX_ROWS:
+                        # Styling for the dataframe: CSS for the whole column in one vectorized pass
+                        def highlight_diff(col):
+                            diff = col.to_numpy(dtype='float64')
+                            return np.where(diff > 0, 'color: red; font-weight: bold',
+                                            np.where(diff < 0, 'color: green; font-weight: bold', ''))
+                        
+                        common_df = common_df.style.apply(highlight_diff, subset=['Diferencia $'])
+                    
+                    st.dataframe(common_df, column_config=common_config, use_container_width=True, hide_index=True)
                     
                 with tab2:
                     st.subheader("Productos que ya NO están en el nuevo archivo (Eliminados)")
-                    st.dataframe(results['only_a_df'].style.format({'Precio': '${:,.2f}'}), use_container_width=True)
+                    st.dataframe(results['only_a_df'], column_config={'Precio': money_format}, use_container_width=True, hide_index=True)
                     
                 with tab3:
                     st.subheader("Productos NUEVOS en el archivo B")
-                    st.dataframe(results['only_b_df'].style.format({'Precio': '${:,.2f}'}), use_container_width=True)
+                    st.dataframe(results['only_b_df'], column_config={'Precio': money_format}, use_container_width=True, hide_index=True)
                     
                 # Export
                 st.divider()
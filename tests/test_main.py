@@ -0,0 +1,199 @@
+import io
+
+import openpyxl
+import pandas as pd
+import xlsxwriter
+
+import main
+
+
+def make_excel(rows):
+    """Builds an in-memory workbook from a list of rows (first row is the header)."""
+    output = io.BytesIO()
+    with xlsxwriter.Workbook(output) as workbook:
+        worksheet = workbook.add_worksheet()
+        for row_idx, row in enumerate(rows):
+            worksheet.write_row(row_idx, 0, row)
+    return output.getvalue()
+
+
+def test_read_excel_file_mixed_text_and_numeric_cells():
+    data = make_excel([
+        ['Clave', 'Precio'],
+        ['001', '$1,200'],
+        [2, 30],
+    ])
+    df = main.read_excel_file(io.BytesIO(data))
+    
+    assert df['Clave'].tolist() == ['001', '2']
+    assert df['Precio'].tolist() == ['$1,200', '30']
+
+
+def test_run_analysis_ignores_rows_without_clave():
+    data_a = make_excel([
+        ['Clave', 'Descripcion', 'Precio'],
+        ['001', 'Filtro', 10],
+        ['002', 'Balata', 20],
+        [None, 'Total', 30],
+    ])
+    data_b = make_excel([
+        ['Clave', 'Descripcion', 'Precio'],
+        ['002', 'Balata', 25],
+        ['   ', '', ''],
+    ])
+    results, error = main.run_analysis(data_a, data_b)
+    
+    assert error is None
+    assert results['common_df']['Clave'].tolist() == ['002']
+    assert results['only_a_df']['Clave'].tolist() == ['001']
+    assert results['only_b_df'].empty
+    assert results['total_a'] == 2
+    assert results['blank_keys_a'] == 1
+    assert results['blank_keys_b'] == 1
+
+
+def test_convert_df_to_excel_formats_every_campo_extra_cell():
+    data_a = make_excel([
+        ['Clave', 'Descripcion', 'Precio'],
+        ['001', 'Filtro', 10],
+        ['002', 'Balata', 20],
+    ])
+    data_b = make_excel([
+        ['Clave', 'Descripcion', 'Precio', 'Campo Extra'],
+        ['001', 'Filtro', 12, 7],
+        ['002', 'Balata', 25, 42],
+    ])
+    results, _ = main.run_analysis(data_a, data_b)
+    
+    workbook = openpyxl.load_workbook(io.BytesIO(main.convert_df_to_excel(results)))
+    worksheet = workbook['Coincidencias']
+    assert worksheet['A1'].value == 'Campo Extra'
+    assert [worksheet.cell(row, 1).number_format for row in (2, 3)] == ['000000', '000000']
+
+
+def test_convert_df_to_excel_handles_infinite_values():
+    data_a = make_excel([
+        ['Clave', 'Descripcion', 'Precio'],
+        ['001', 'Filtro', 10],
+    ])
+    data_b = make_excel([
+        ['Clave', 'Descripcion', 'Precio', 'Campo Extra'],
+        ['001', 'Filtro', 10, '1e400'],
+    ])
+    results, _ = main.run_analysis(data_a, data_b)
+    
+    workbook = openpyxl.load_workbook(io.BytesIO(main.convert_df_to_excel(results)))
+    assert workbook['Coincidencias']['B2'].value == '001'
+
+
+def test_run_analysis_reports_duplicated_claves():
+    data_a = make_excel([
+        ['Clave', 'Descripcion', 'Precio'],
+        ['001', 'Filtro', 10],
+        ['001', 'Filtro', 12],
+        ['002', 'Balata', 20],
+    ])
+    data_b = make_excel([
+        ['Clave', 'Descripcion', 'Precio'],
+        ['001', 'Filtro', 15],
+    ])
+    results, _ = main.run_analysis(data_a, data_b)
+    
+    assert results['total_a'] == 3
+    assert results['duplicates_a'] == 1
+    assert results['duplicates_b'] == 0
+    assert results['common_df']['Precio_A'].tolist() == [12.0]
+
+
+def test_run_analysis_keeps_suffixes_for_column_empty_in_one_file():
+    data_a = make_excel([
+        ['Clave', 'Descripcion', 'Precio', 'Marca', 'Vacia'],
+        ['001', 'Filtro', 10, None, None],
+    ])
+    data_b = make_excel([
+        ['Clave', 'Descripcion', 'Precio', 'Marca'],
+        ['001', 'Filtro', 12, 'Bosch'],
+    ])
+    for first, second, filled in ((data_a, data_b, 'Marca_B'), (data_b, data_a, 'Marca_A')):
+        results, _ = main.run_analysis(first, second)
+        common = results['common_df']
+        
+        assert {'Marca_A', 'Marca_B'} <= set(common.columns)
+        assert 'Marca' not in common.columns
+        assert not any(c.startswith('Vacia') for c in common.columns)
+        assert common[filled].tolist() == ['Bosch']
+
+
+def test_clean_price_series():
+    prices = pd.Series(['$1,234.5', '', None, 'N/A', '-3.257', '30'], dtype='string[pyarrow]')
+    
+    assert main.clean_price_series(prices).tolist() == [1234.5, 0.0, 0.0, 0.0, -3.26, 30.0]
+    assert main.clean_price_series(pd.Series([1.234, None])).tolist() == [1.23, 0.0]
+
+
+def test_normalize_columns_matches_candidates_case_insensitively():
+    df = pd.DataFrame({
+        ' SKU ': ['x1'],
+        'CLAVE': [' ab-01 '],
+        'DESCRIPCIÓN': ['Filtro'],
+        'Costo': ['$3'],
+    })
+    df, valid = main.normalize_columns(df)
+    
+    assert valid
+    # 'clave' is preferred over 'sku' regardless of column order
+    assert df['Clave'].tolist() == ['AB-01']
+    assert df['SKU'].tolist() == ['x1']
+    assert df['Descripcion'].tolist() == ['Filtro']
+    assert df['Precio'].tolist() == [3.0]
+
+
+def test_normalize_columns_without_clave():
+    _, valid = main.normalize_columns(pd.DataFrame({'Nombre': ['Filtro']}))
+    
+    assert not valid
+
+
+def test_split_by_clave():
+    df_a = pd.DataFrame({
+        'Clave': ['3', '1', '2'],
+        'Descripcion': ['c', 'a', 'b'],
+        'Precio': [3.0, 1.0, 2.0],
+        'Marca': ['m3', 'm1', 'm2'],
+    })
+    df_b = pd.DataFrame({
+        'Clave': ['4', '2', '3'],
+        'Descripcion': ['d', 'b', 'c'],
+        'Precio': [4.0, 2.5, 3.5],
+        'Color': ['rojo', 'azul', 'verde'],
+    })
+    common, only_a, only_b = main.split_by_clave(df_a, df_b)
+    
+    # Rows keep file A's order; shared columns get suffixes, the rest keep their name
+    assert common.columns.tolist() == [
+        'Clave', 'Descripcion_A', 'Precio_A', 'Marca', 'Descripcion_B', 'Precio_B', 'Color'
+    ]
+    assert common['Clave'].tolist() == ['3', '2']
+    assert common['Precio_A'].tolist() == [3.0, 2.0]
+    assert common['Precio_B'].tolist() == [3.5, 2.5]
+    assert common['Color'].tolist() == ['verde', 'azul']
+    
+    assert only_a.columns.tolist() == df_a.columns.tolist()
+    assert only_a['Clave'].tolist() == ['1']
+    assert only_b.columns.tolist() == df_b.columns.tolist()
+    assert only_b['Clave'].tolist() == ['4']
+
+
+def test_text_similarity_series():
+    desc_a = pd.Series(['Filtro de Aceite', 'Filtro aceite', '', None, 'Balata'])
+    desc_b = pd.Series(['filtro de aceite', 'FILTRO de aceite', '', 'Bujia', 'Amortiguador'])
+    sim = main.text_similarity_series(desc_a, desc_b)
+    
+    assert sim.dtype == 'float64'
+    # Identical (case-insensitive) descriptions take the shortcut
+    assert sim[0] == 100.0
+    assert round(sim[1], 2) == 89.66
+    # Empty descriptions score 0, even when both sides are empty
+    assert sim[2] == 0.0
+    assert sim[3] == 0.0
+    assert 0.0 < sim[4] < 50.0